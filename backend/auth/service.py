@@ -1,111 +1,154 @@
 """Authentication service for user management and JWT token generation."""
-from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from schemas.auth import User as UserSchema, TokenPayload, LoginResponse
+from cachetools import LRUCache
+import jwt
+import bcrypt
+import hashlib
+import threading
+import time
+from schemas.auth import UserPublic, TokenPayload, LoginResponse
 from config import settings
-from database import get_db, SessionLocal
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, undefer
+from database import SessionLocal
 from database.models import User as UserModel
 import uuid
 
+# Process-wide password hashing configuration
+_BCRYPT_ROUNDS = settings.BCRYPT_ROUNDS
+
+# Precomputed bcrypt hashes of the fixed development passwords
+# ("password123" and "admin123") so seeding never hashes at startup
+DEFAULT_USER1_HASH = "$2b$12$ul30q3tpjX0v2HhcVs97Ae//8/MMC2.3JM4QQk23bgAWwrfbOSmeu"
+DEFAULT_ADMIN_HASH = "$2b$12$Wb2eFhpzBiDNrIWp.33S..VgI2utAINO/A4xekhILzEnPjuCFRehe"
+
+# Verified tokens keyed on sha256(token) -> (payload, cached_until)
+_token_cache: LRUCache = LRUCache(maxsize=settings.JWT_CACHE_SIZE)
+_token_cache_lock = threading.Lock()
+
+
+def _insert(db: Session):
+    """Return the dialect-specific insert() so ON CONFLICT is available."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    return insert
+
 
 class AuthService:
     """Handles user authentication and JWT token management."""
 
     def __init__(self):
         """Initialize authentication service."""
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        self._initialize_default_users()
+        # Bind token settings once; they are read on every request
+        self._secret = settings.SECRET_KEY
+        self._alg = settings.ALGORITHM
+        self._exp_seconds = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        self._token_cache_ttl = settings.JWT_CACHE_TTL_SECONDS
+
+        if settings.ENVIRONMENT == "development":
+            self._initialize_default_users()
 
     def _initialize_default_users(self):
         """Create default users for development if they don't exist."""
         db = SessionLocal()
         try:
             # Check if users already exist
-            if db.query(UserModel).count() == 0:
-                # Create default regular user
-                user1 = UserModel(
-                    user_id=str(uuid.uuid4()),
-                    username="user1",
-                    password_hash=self.get_password_hash("password123"),
-                    is_admin=False
-                )
-                db.add(user1)
-
-                # Create default admin user
-                admin = UserModel(
-                    user_id=str(uuid.uuid4()),
-                    username="admin",
-                    password_hash=self.get_password_hash("admin123"),
-                    is_admin=True
-                )
-                db.add(admin)
+            if db.query(UserModel.user_id).limit(1).first():
+                return
 
-                db.commit()
+            # Create default regular and admin users in one round-trip
+            user1 = UserModel(
+                user_id=str(uuid.uuid4()),
+                username="user1",
+                password_hash=DEFAULT_USER1_HASH,
+                is_admin=False
+            )
+            admin = UserModel(
+                user_id=str(uuid.uuid4()),
+                username="admin",
+                password_hash=DEFAULT_ADMIN_HASH,
+                is_admin=True
+            )
+            db.bulk_save_objects([user1, admin])
+            db.commit()
         finally:
             db.close()
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash."""
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
     def get_password_hash(self, password: str) -> str:
         """Generate password hash."""
-        return self.pwd_context.hash(password)
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=_BCRYPT_ROUNDS)).decode()
 
-    def authenticate_user(self, username: str, password: str) -> Optional[UserSchema]:
+    def authenticate_user(self, db: Session, username: str, password: str) -> Optional[UserPublic]:
         """Authenticate a user by username and password."""
-        db = SessionLocal()
-        try:
-            user_model = db.query(UserModel).filter(UserModel.username == username).first()
-            if not user_model:
-                return None
-            if not self.verify_password(password, user_model.password_hash):
-                return None
-
-            # Convert to schema
-            return UserSchema(
-                user_id=user_model.user_id,
-                username=user_model.username,
-                password_hash=user_model.password_hash,
-                is_admin=user_model.is_admin
-            )
-        finally:
-            db.close()
+        user_model = (
+            db.query(UserModel)
+            .options(undefer(UserModel.password_hash))
+            .filter(UserModel.username == username)
+            .first()
+        )
+        if not user_model:
+            return None
+        if not self.verify_password(password, user_model.password_hash):
+            return None
+
+        # Convert to schema
+        return UserPublic.from_model(user_model)
 
-    def create_access_token(self, user: UserSchema) -> str:
+    def create_access_token(self, user: UserPublic) -> str:
         """Create JWT access token for authenticated user."""
-        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        payload = TokenPayload(
-            sub=user.user_id,
-            username=user.username,
-            is_admin=user.is_admin,
-            exp=int(expire.timestamp())
-        )
+        payload = {
+            "sub": user.user_id,
+            "username": user.username,
+            "is_admin": user.is_admin,
+            "exp": int(time.time()) + self._exp_seconds
+        }
         token = jwt.encode(
-            payload.model_dump(),
-            settings.SECRET_KEY,
-            algorithm=settings.ALGORITHM
+            payload,
+            self._secret,
+            algorithm=self._alg
         )
         return token
 
     def verify_token(self, token: str) -> Optional[TokenPayload]:
         """Verify and decode JWT token."""
+        cache_key = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+
+        with _token_cache_lock:
+            cached = _token_cache.get(cache_key)
+        if cached is not None:
+            token_data, cached_until = cached
+            if token_data.exp > now and cached_until > now:
+                return token_data
+            with _token_cache_lock:
+                _token_cache.pop(cache_key, None)
+
         try:
             payload = jwt.decode(
                 token,
-                settings.SECRET_KEY,
-                algorithms=[settings.ALGORITHM]
+                self._secret,
+                algorithms=[self._alg]
             )
             token_data = TokenPayload(**payload)
-            return token_data
-        except JWTError:
+        except jwt.PyJWTError:
             return None
 
-    def login(self, username: str, password: str) -> Optional[LoginResponse]:
+        with _token_cache_lock:
+            _token_cache[cache_key] = (token_data, now + self._token_cache_ttl)
+        return token_data
+
+    def login(self, db: Session, username: str, password: str) -> Optional[LoginResponse]:
         """Process user login and return access token."""
-        user = self.authenticate_user(username, password)
+        user = self.authenticate_user(db, username, password)
         if not user:
             return None
 
@@ -118,72 +161,61 @@ class AuthService:
             is_admin=user.is_admin
         )
 
-    def get_user_by_id(self, user_id: str) -> Optional[UserSchema]:
+    def get_user_by_id(self, db: Session, user_id: str) -> Optional[UserPublic]:
         """Get user by user_id."""
-        db = SessionLocal()
-        try:
-            user_model = db.query(UserModel).filter(UserModel.user_id == user_id).first()
-            if not user_model:
-                return None
-
-            # Convert to schema
-            return UserSchema(
-                user_id=user_model.user_id,
-                username=user_model.username,
-                password_hash=user_model.password_hash,
-                is_admin=user_model.is_admin
-            )
-        finally:
-            db.close()
+        user_model = db.get(UserModel, user_id)
+        if not user_model:
+            return None
+
+        # Convert to schema
+        return UserPublic.from_model(user_model)
 
-    def register_user(self, username: str, password: str) -> Optional[LoginResponse]:
+    def register_user(self, db: Session, username: str, password: str) -> Optional[LoginResponse]:
         """Register a new user."""
-        db = SessionLocal()
         try:
-            # Check if username already exists
-            existing_user = db.query(UserModel).filter(UserModel.username == username).first()
-            if existing_user:
-                return None  # Username already taken
-
-            # Create new user
-            new_user = UserModel(
-                user_id=str(uuid.uuid4()),
+            # Single INSERT; the unique index on username rejects duplicates
+            user_id = str(uuid.uuid4())
+            stmt = _insert(db)(UserModel).values(
+                user_id=user_id,
                 username=username,
                 password_hash=self.get_password_hash(password),
                 is_admin=False  # New users are not admin by default
             )
-            db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
-
-            # Convert to schema
-            user_schema = UserSchema(
-                user_id=new_user.user_id,
-                username=new_user.username,
-                password_hash=new_user.password_hash,
-                is_admin=new_user.is_admin
-            )
+            if hasattr(stmt, "on_conflict_do_nothing"):
+                stmt = stmt.on_conflict_do_nothing(index_elements=["username"])
+            try:
+                result = db.execute(stmt)
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return None  # Username already taken
+            if result.rowcount == 0:
+                return None  # Username already taken
+
+            user = UserPublic.model_construct(user_id=user_id, username=username, is_admin=False)
 
             # Auto-login: generate token
-            access_token = self.create_access_token(user_schema)
+            access_token = self.create_access_token(user)
             return LoginResponse(
                 access_token=access_token,
                 token_type="bearer",
-                user_id=user_schema.user_id,
-                username=user_schema.username,
-                is_admin=user_schema.is_admin
+                user_id=user.user_id,
+                username=user.username,
+                is_admin=user.is_admin
             )
         except Exception as e:
             db.rollback()
             return None
-        finally:
-            db.close()
 
-    def change_password(self, user_id: str, old_password: str, new_password: str) -> bool:
+    def change_password(self, db: Session, user_id: str, old_password: str, new_password: str) -> bool:
         """Change user password."""
-        db = SessionLocal()
         try:
-            user_model = db.query(UserModel).filter(UserModel.user_id == user_id).first()
+            user_model = (
+                db.query(UserModel)
+                .options(undefer(UserModel.password_hash))
+                .filter(UserModel.user_id == user_id)
+                .first()
+            )
             if not user_model:
                 return False
 
@@ -198,5 +230,3 @@ class AuthService:
         except Exception as e:
             db.rollback()
             return False
-        finally:
-            db.close()
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from typing import Optional
-import os
+from functools import lru_cache
 
 
 class Settings(BaseSettings):
@@ -17,6 +17,9 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "dev-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    BCRYPT_ROUNDS: int = 12  # bcrypt cost factor (work grows as 2^rounds)
+    JWT_CACHE_SIZE: int = 10000
+    JWT_CACHE_TTL_SECONDS: int = 30  # max lifetime of a cached token verification (never past exp)
 
     # CORS
     CORS_ORIGINS: list[str] = ["http://localhost:3000", "http://127.0.0.1:3000"]
@@ -30,28 +33,53 @@ class Settings(BaseSettings):
     REDIS_DB: int = 0
     REDIS_PASSWORD: Optional[str] = None
 
-    MODEL_PATH: str = os.getenv("MODEL_PATH", "/app/models/model.gguf")
-
-    MODEL_N_CTX: int = int(os.getenv("MODEL_N_CTX", 4096))
-    MODEL_N_THREADS: int = int(os.getenv("MODEL_N_THREADS", 4))
-    MODEL_N_GPU_LAYERS: int = int(os.getenv("MODEL_N_GPU_LAYERS", 0))
-    MODEL_TEMPERATURE: float = float(os.getenv("MODEL_TEMPERATURE", 0.0))
-    MODEL_TOP_P: float = float(os.getenv("MODEL_TOP_P", 1.0))
-    MODEL_MAX_TOKENS: int = int(os.getenv("MODEL_MAX_TOKENS", 1024))
-    MODEL_N_BATCH: int = int(os.getenv("MODEL_N_BATCH", 128))
+    # LLM model (pydantic-settings reads and parses these env vars by name)
+    MODEL_PATH: str = "/app/models/model.gguf"
+    # Preferred GGUF K-quant: Q4_K_M (default, fastest decode) or Q5_K_M (higher quality).
+    # A "<stem>.<MODEL_QUANT>.gguf" sibling of MODEL_PATH is loaded when present.
+    MODEL_QUANT: Optional[str] = "Q4_K_M"
+    MODEL_N_CTX: int = 4096
+    MODEL_N_THREADS: Optional[int] = None  # unset/0: one thread per usable CPU
+    MODEL_N_GPU_LAYERS: Optional[int] = None  # unset/negative: offload all layers if the build supports GPU
+    MODEL_TENSOR_SPLIT: Optional[str] = None  # multi-GPU proportions, e.g. "0.6,0.4"
+    MODEL_TENSORCORE_BUILD: Optional[bool] = None  # unset: use llama_cpp_cuda_tensorcore on compute capability >= 7.5
+    MODEL_TEMPERATURE: float = 0.0
+    MODEL_TOP_P: float = 1.0
+    MODEL_MAX_TOKENS: int = 1024
+    MODEL_N_BATCH: int = 2048  # logical prefill batch
+    MODEL_N_UBATCH: int = 512  # physical micro-batch per compute pass
+    # Per-session KV snapshots kept in RAM so switching back to a session skips
+    # its prefill. Each one copies the whole KV cache (hundreds of MB to ~1 GB
+    # for an 8B model at n_ctx 4096) after every turn; the active session's
+    # prefix is reused by llama.cpp without this. 0 disables.
+    MODEL_SESSION_STATES: int = 0
+    MOCK_STREAM_DELAY: float = 0.05  # per-word delay of the no-model mock stream (0 disables)
 
     # Cache settings
     CACHE_TTL_SECONDS: int = 3600  # 1 hour
+    CACHE_MAX_ENTRIES: int = 1024  # in-memory fallback bound
     ENABLE_CACHE: bool = True
 
+    # Monitoring
+    METRICS_REFRESH_SECONDS: float = 1.0  # admin metrics snapshot interval
+
     # Rate limiting
     RATE_LIMIT_REQUESTS: int = 10
     RATE_LIMIT_PERIOD: int = 60  # seconds
+    LOGIN_IP_RATE_LIMIT_REQUESTS: int = 100  # failed logins per client IP, any username
+    # Comma-separated peer IPs (e.g. the frontend BFF) whose X-Forwarded-For is trusted
+    TRUSTED_PROXIES: str = "127.0.0.1,::1"
 
     class Config:
         env_file = ".env"
         case_sensitive = True
 
 
+@lru_cache
+def get_settings() -> Settings:
+    """Return the process-wide settings, reading the environment once."""
+    return Settings()
+
+
 # Global settings instance
-settings = Settings()
+settings = get_settings()
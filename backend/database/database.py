@@ -6,21 +6,44 @@ Architecture Reference: HW3 Section 3.2 - Database Layer
 - Session management
 - Database initialization
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from config import settings
 
 # SQLite database URL
 DATABASE_URL = getattr(settings, 'DATABASE_URL', 'sqlite:///./pocketllm.db')
 
+# Connection pool configuration
+if DATABASE_URL.startswith('sqlite'):
+    engine_kwargs = {"connect_args": {"check_same_thread": False}}
+    if ":memory:" in DATABASE_URL or DATABASE_URL == "sqlite://":
+        # In-memory databases live on a single connection
+        engine_kwargs["poolclass"] = StaticPool
+else:
+    engine_kwargs = {
+        "pool_size": 20,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+    }
+
 # Create SQLAlchemy engine
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith('sqlite') else {},
-    echo=settings.DEBUG  # Log SQL queries in debug mode
+    echo=settings.DEBUG,  # Log SQL queries in debug mode
+    **engine_kwargs
 )
 
+if DATABASE_URL.startswith('sqlite') and "poolclass" not in engine_kwargs:
+    @event.listens_for(engine, "connect")
+    def _enable_wal(dbapi_connection, connection_record):
+        """WAL lets readers proceed while a message insert is committing."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
 # Create SessionLocal class for database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
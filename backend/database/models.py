@@ -7,7 +7,7 @@ Architecture Reference: HW3 Section 3.2 - Database Schema
 - Message model for chat messages
 """
 from sqlalchemy import Column, String, Boolean, Integer, DateTime, ForeignKey, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from .database import Base
 
@@ -27,7 +27,7 @@ class User(Base):
 
     user_id = Column(String(36), primary_key=True, index=True)
     username = Column(String(100), unique=True, nullable=False, index=True)
-    password_hash = Column(String(255), nullable=False)
+    password_hash = deferred(Column(String(255), nullable=False))  # Only loaded when verifying
     is_admin = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
@@ -7,6 +7,7 @@ Implements the architecture from HW3 with service-based design.
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 
 # Import configuration
 from config import settings
@@ -20,7 +21,7 @@ from services.monitoring_service import MonitoringService
 
 # Import routers
 from routers.auth_router import router as auth_router
-from routers.chat_router import router as chat_router
+from routers.chat_router import router as chat_router, drain_background_tasks
 from routers.admin_router import router as admin_router
 
 # Import dependencies module to set global instances
@@ -48,26 +49,33 @@ async def lifespan(app: FastAPI):
     # Initialize services
     print("Initializing services...")
 
+    # Independent services are constructed concurrently on worker threads,
+    # alongside the (potentially slow) model load
+    llm_engine = LLMEngine()
+    auth_service, session_service, cache_manager, monitoring_service, model_loaded = await asyncio.gather(
+        asyncio.to_thread(AuthService),
+        asyncio.to_thread(SessionService),
+        asyncio.to_thread(CacheManager),
+        asyncio.to_thread(MonitoringService),
+        asyncio.to_thread(llm_engine.load_model),
+    )
+
     # Auth service
-    auth_service = AuthService()
     print(" Auth service initialized")
 
     # Session service
-    session_service = SessionService()
     print(" Session service initialized")
 
     # Cache manager
-    cache_manager = CacheManager()
+    await cache_manager.connect()
     if cache_manager.enabled:
         print(f" Cache manager initialized (Redis: {settings.REDIS_HOST}:{settings.REDIS_PORT})")
     else:
         print(" Cache manager disabled (Redis not available)")
 
     # LLM engine
-    llm_engine = LLMEngine()
-    model_loaded = llm_engine.load_model()
     if model_loaded:
-        print(f" LLM engine initialized (Model: {settings.MODEL_PATH})")
+        print(f" LLM engine initialized (Model: {llm_engine.model_path})")
     else:
         print(" LLM engine in mock mode (Model not loaded)")
 
@@ -76,7 +84,6 @@ async def lifespan(app: FastAPI):
     print(" Inference service initialized")
 
     # Monitoring service
-    monitoring_service = MonitoringService()
     print(" Monitoring service initialized")
 
     # Set global service instances for dependency injection
@@ -86,19 +93,41 @@ async def lifespan(app: FastAPI):
     deps.inference_service = inference_service
     deps.monitoring_service = monitoring_service
 
+    # Admin metrics are served from a snapshot refreshed in the background
+    async def _metrics_refresher():
+        while True:
+            await asyncio.sleep(settings.METRICS_REFRESH_SECONDS)
+            try:
+                cache_stats = await cache_manager.get_stats()
+                await asyncio.to_thread(monitoring_service.refresh_snapshot, cache_stats, session_service)
+            except Exception as e:
+                print(f"[Monitoring] Metrics refresh error: {e}")
+
+    cache_stats = await cache_manager.get_stats()
+    await asyncio.to_thread(monitoring_service.refresh_snapshot, cache_stats, session_service)
+    metrics_task = asyncio.create_task(_metrics_refresher())
+
     print("=" * 60)
     print(f"Server ready on http://{settings.HOST}:{settings.PORT}")
     print(f"API docs available at http://{settings.HOST}:{settings.PORT}/docs")
     print("=" * 60)
-    print("\nDefault users:")
-    print("  Regular user: username='user1', password='password123'")
-    print("  Admin user:   username='admin', password='admin123'")
-    print("=" * 60)
+    if settings.ENVIRONMENT == "development":
+        print("\nDefault users:")
+        print("  Regular user: username='user1', password='password123'")
+        print("  Admin user:   username='admin', password='admin123'")
+        print("=" * 60)
 
     yield
 
     # Shutdown
     print("\nShutting down services...")
+    metrics_task.cancel()
+    try:
+        await metrics_task
+    except asyncio.CancelledError:
+        pass
+    await drain_background_tasks()
+    await cache_manager.close()
     print("Goodbye!")
 
 
@@ -139,7 +168,6 @@ async def root():
 @app.get("/health")
 async def health():
     """Health check endpoint."""
-    cache_stats = deps.cache_manager.get_stats()
     model_info = deps.inference_service.llm_engine.get_model_info()
 
     return {
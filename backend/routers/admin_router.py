@@ -5,6 +5,7 @@ from schemas.auth import TokenPayload
 from schemas.admin import SystemMetrics, CacheFlushResponse, ModelConfig
 from utils.dependencies import get_current_admin
 import utils.dependencies as deps
+import asyncio
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -17,11 +18,7 @@ async def get_metrics(
     Get system metrics (admin only).
     """
     deps.monitoring_service.increment_request_count()
-
-    cache_stats = deps.cache_manager.get_stats()
-    active_sessions = deps.session_service.get_total_sessions_count()
-
-    return deps.monitoring_service.get_system_metrics(cache_stats, active_sessions)
+    return deps.monitoring_service.latest_metrics["system"]
 
 
 @router.post("/cache/flush", response_model=CacheFlushResponse)
@@ -32,7 +29,11 @@ async def flush_cache(
     Flush all cache entries (admin only).
     """
     deps.monitoring_service.increment_request_count()
-    entries_flushed = deps.cache_manager.flush()
+    entries_flushed = await deps.cache_manager.flush()
+
+    # Refresh the metrics snapshot now so stats don't report pre-flush counts
+    cache_stats = await deps.cache_manager.get_stats()
+    await asyncio.to_thread(deps.monitoring_service.refresh_snapshot, cache_stats, deps.session_service)
 
     return CacheFlushResponse(
         success=True,
@@ -57,6 +58,8 @@ async def get_model_info(
         n_ctx=info["n_ctx"],
         n_threads=info["n_threads"],
         n_gpu_layers=info["n_gpu_layers"],
+        n_batch=info["n_batch"],
+        n_ubatch=info["n_ubatch"],
         temperature=info["temperature"],
         top_p=info["top_p"],
         max_tokens=info["max_tokens"]
@@ -71,7 +74,7 @@ async def get_cache_stats(
     Get cache statistics (admin only).
     """
     deps.monitoring_service.increment_request_count()
-    return deps.cache_manager.get_stats()
+    return deps.monitoring_service.latest_metrics["cache"]
 
 
 @router.get("/sessions/count")
@@ -82,7 +85,4 @@ async def get_session_count(
     Get total session count (admin only).
     """
     deps.monitoring_service.increment_request_count()
-    return {
-        "total_sessions": deps.session_service.get_total_sessions_count(),
-        "total_users": deps.session_service.get_total_users_count()
-    }
+    return deps.monitoring_service.latest_metrics["sessions"]
@@ -1,15 +1,83 @@
 """Authentication API router."""
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 from typing import Annotated
+from collections import deque
+from cachetools import TTLCache
+from sqlalchemy.orm import Session
 from schemas.auth import LoginRequest, LoginResponse, RegisterRequest, ChangePasswordRequest, ChangePasswordResponse, TokenPayload
 from utils.dependencies import get_current_user
+from database import get_db
 import utils.dependencies as deps
+import asyncio
+import time
+from config import settings
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+# Recent failed login times per (client_ip, username) and per client_ip.
+# TTLCache bounds both tables: idle keys expire after one window, and when
+# full the least recently used key is evicted instead of scanning the table.
+_LOGIN_ATTEMPTS_MAX_KEYS = 10000
+_login_attempts: TTLCache = TTLCache(maxsize=_LOGIN_ATTEMPTS_MAX_KEYS, ttl=settings.RATE_LIMIT_PERIOD)
+_login_attempts_by_ip: TTLCache = TTLCache(maxsize=_LOGIN_ATTEMPTS_MAX_KEYS, ttl=settings.RATE_LIMIT_PERIOD)
+
+_TRUSTED_PROXIES = frozenset(p.strip() for p in settings.TRUSTED_PROXIES.split(",") if p.strip())
+
+
+def _client_ip(request: Request) -> str:
+    """Client address, taken from X-Forwarded-For only when the peer is a trusted proxy."""
+    peer = request.client.host if request.client else "unknown"
+    if peer not in _TRUSTED_PROXIES:
+        return peer
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded:
+        return peer
+    # Rightmost address not added by one of our own proxies
+    for addr in reversed(forwarded.split(",")):
+        addr = addr.strip()
+        if addr and addr not in _TRUSTED_PROXIES:
+            return addr
+    return peer
+
+
+def _over_limit(table: TTLCache, key, limit: int, now: float) -> bool:
+    """Check one sliding-window bucket without recording the attempt."""
+    attempts = table.get(key)
+    if attempts is None:
+        return False
+    window_start = now - settings.RATE_LIMIT_PERIOD
+    while attempts and attempts[0] <= window_start:
+        attempts.popleft()
+    return len(attempts) >= limit
+
+
+def _record(table: TTLCache, key, now: float):
+    """Append an attempt; re-inserting the key restarts its TTL."""
+    attempts = table.get(key) or deque()
+    attempts.append(now)
+    table[key] = attempts
+
+
+def _login_rate_limited(client_ip: str, username: str) -> bool:
+    """Report whether recent failed logins exceed the rate limit."""
+    now = time.monotonic()
+    return (_over_limit(_login_attempts, (client_ip, username), settings.RATE_LIMIT_REQUESTS, now)
+            or _over_limit(_login_attempts_by_ip, client_ip, settings.LOGIN_IP_RATE_LIMIT_REQUESTS, now))
+
+
+def _record_failed_login(client_ip: str, username: str):
+    """Count a failed login; successful logins never use up the limit."""
+    now = time.monotonic()
+    _record(_login_attempts, (client_ip, username), now)
+    _record(_login_attempts_by_ip, client_ip, now)
+
 
 @router.post("/login", response_model=LoginResponse)
-async def login(request: LoginRequest):
+async def login(
+    request: LoginRequest,
+    http_request: Request,
+    db: Annotated[Session, Depends(get_db)]
+):
     """
     User login endpoint.
 
@@ -17,9 +85,21 @@ async def login(request: LoginRequest):
     """
     deps.monitoring_service.increment_request_count()
 
-    login_response = deps.auth_service.login(request.username, request.password)
+    # Cap attacker-controlled bcrypt work before verifying the password
+    client_ip = _client_ip(http_request)
+    if _login_rate_limited(client_ip, request.username):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please try again later"
+        )
+
+    # bcrypt verification is CPU-bound; keep it off the event loop
+    login_response = await asyncio.to_thread(
+        deps.auth_service.login, db, request.username, request.password
+    )
 
     if not login_response:
+        _record_failed_login(client_ip, request.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -30,7 +110,10 @@ async def login(request: LoginRequest):
 
 
 @router.post("/register", response_model=LoginResponse)
-async def register(request: RegisterRequest):
+async def register(
+    request: RegisterRequest,
+    db: Annotated[Session, Depends(get_db)]
+):
     """
     User registration endpoint.
 
@@ -52,7 +135,9 @@ async def register(request: RegisterRequest):
             detail="Password must be at least 6 characters long"
         )
 
-    register_response = deps.auth_service.register_user(request.username, request.password)
+    register_response = await asyncio.to_thread(
+        deps.auth_service.register_user, db, request.username, request.password
+    )
 
     if not register_response:
         raise HTTPException(
@@ -66,7 +151,8 @@ async def register(request: RegisterRequest):
 @router.post("/change-password", response_model=ChangePasswordResponse)
 async def change_password(
     request: ChangePasswordRequest,
-    current_user: Annotated[TokenPayload, Depends(get_current_user)]
+    current_user: Annotated[TokenPayload, Depends(get_current_user)],
+    db: Annotated[Session, Depends(get_db)]
 ):
     """
     Change password endpoint (requires authentication).
@@ -82,7 +168,9 @@ async def change_password(
             detail="New password must be at least 6 characters long"
         )
 
-    success = deps.auth_service.change_password(
+    success = await asyncio.to_thread(
+        deps.auth_service.change_password,
+        db,
         current_user.sub,
         request.old_password,
         request.new_password
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
 from typing import Annotated, List
 from schemas.chat import ChatRequest, ChatResponse, ChatHistory
 from schemas.auth import TokenPayload
 from utils.dependencies import get_current_user
+from database import get_db
+from sqlalchemy.orm import Session
 from utils.prompt_builder import (
     build_prompt,
     load_system_prompt,
@@ -12,61 +15,119 @@ from utils.prompt_builder import (
 import utils.dependencies as deps
 from datetime import datetime
 import uuid
-import json
+import orjson
 import asyncio
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+# Streamed tokens are flushed every N tokens or after this many seconds
+_TOKEN_BATCH_SIZE = 16
+_TOKEN_FLUSH_INTERVAL = 0.03
+
+
+# Serializes session lists in one pass without re-validating each message
+_history_adapter = TypeAdapter(List[ChatHistory])
+
+# Fixed-shape envelope frames, formatted directly as bytes
+_START_TMPL = b'data: {"type":"start","session_id":"%s","message_id":"%s"}\n\n'
+_DONE_TMPL = b'data: {"type":"done","tokens_used":%d,"cached":%s,"timestamp":"%s"}\n\n'
+_ERROR_TMPL = b'data: {"type":"error","message":%s}\n\n'
+
+# Strong references to in-flight background writes so they aren't garbage collected
+background_tasks: set = set()
+
+
+def _sse(d: dict) -> bytes:
+    """Encode a plain dict as one SSE data frame."""
+    return b"data: " + orjson.dumps(d) + b"\n\n"
+
+
+def _sse_error(message: str) -> bytes:
+    """Error frame; the message is JSON-escaped since it can contain anything."""
+    return _ERROR_TMPL % orjson.dumps(message)
+
+
+def _on_save_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if task.cancelled():
+        return
+    e = task.exception()
+    if isinstance(e, ValueError):
+        print(f"[WARNING] Failed to save assistant message: {str(e)}")
+    elif e is not None:
+        print(f"[ERROR] Unexpected error saving assistant message: {type(e).__name__}: {str(e)}")
+
+
+def save_message_in_background(**kwargs) -> asyncio.Task:
+    """Write a message off the response path; the client doesn't wait on it."""
+    # Stamp now so a late write still sorts before the next turn
+    kwargs.setdefault("timestamp", datetime.utcnow())
+    task = asyncio.create_task(asyncio.to_thread(deps.session_service.add_message, **kwargs))
+    background_tasks.add(task)
+    task.add_done_callback(_on_save_done)
+    return task
+
+
+async def drain_background_tasks():
+    """Wait for pending message writes (called on shutdown)."""
+    if background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
 
 @router.post("", response_model=ChatResponse)
 async def send_message(
     request: ChatRequest,
-    current_user: Annotated[TokenPayload, Depends(get_current_user)]
+    current_user: Annotated[TokenPayload, Depends(get_current_user)],
+    db: Annotated[Session, Depends(get_db)]
 ):
     deps.monitoring_service.increment_request_count()
 
     session_id = request.session_id
+    conversation_history = []
     if not session_id:
-        session_id = deps.session_service.create_session(current_user.sub)
+        session_id = deps.session_service.create_session(current_user.sub, db=db)
     else:
-        session = deps.session_service.get_session(session_id)
-        if not session:
+        # Ownership check reads only the owner column, not the message list
+        owner = deps.session_service.get_session_owner(session_id, db=db)
+        if owner is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
-        if session.user_id != current_user.sub:
+        if owner != current_user.sub:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this session")
+        # Only keep recent conversation history, loaded with a bounded query
+        conversation_history = deps.session_service.get_recent_messages(session_id, limit=3, db=db)
 
     deps.session_service.add_message(
         session_id=session_id,
         user_id=current_user.sub,
         role="user",
         content=request.prompt,
-        tokens_used=None
+        tokens_used=None,
+        db=db
     )
 
-    session = deps.session_service.get_session(session_id)
-    conversation_history = session.messages if session else []
-
-    # Only keep recent conversation history
-    conversation_history = conversation_history[:-1][-3:]
-
     system_prompt = load_system_prompt("prompt.txt")
     formatted_prompt = build_prompt(conversation_history, system_prompt, request.prompt)
 
-    response_text, cached = deps.inference_service.infer(
+    cache_key = build_cache_key(current_user.sub, request.prompt, history=conversation_history, system_prompt=system_prompt)
+
+    response_text, cached, tokens_used = await deps.inference_service.infer(
         prompt=formatted_prompt,
         max_tokens=request.max_tokens,
         temperature=request.temperature,
-        use_cache=True
+        use_cache=True,
+        cache_key=cache_key,
+        session_id=session_id
     )
 
-    tokens_used = len(response_text.split())
-
-    deps.session_service.add_message(
+    # One timestamp for the stored message and the response
+    now = datetime.utcnow()
+    save_message_in_background(
         session_id=session_id,
         user_id=current_user.sub,
         role="assistant",
         content=response_text,
-        tokens_used=tokens_used
+        tokens_used=tokens_used,
+        timestamp=now
     )
 
     return ChatResponse(
@@ -75,21 +136,21 @@ async def send_message(
         response=response_text,
         tokens_used=tokens_used,
         cached=cached,
-        timestamp=datetime.utcnow()
+        timestamp=now
     )
 
 
 @router.get("/history", response_model=List[ChatHistory])
-async def get_history(current_user: Annotated[TokenPayload, Depends(get_current_user)]):
+async def get_history(current_user: Annotated[TokenPayload, Depends(get_current_user)], db: Annotated[Session, Depends(get_db)]):
     deps.monitoring_service.increment_request_count()
-    sessions = deps.session_service.get_user_sessions(current_user.sub)
-    return sessions
+    sessions = deps.session_service.get_user_sessions(current_user.sub, db=db)
+    return Response(content=_history_adapter.dump_json(sessions), media_type="application/json")
 
 
 @router.get("/history/{session_id}", response_model=ChatHistory)
-async def get_session_history(session_id: str, current_user: Annotated[TokenPayload, Depends(get_current_user)]):
+async def get_session_history(session_id: str, current_user: Annotated[TokenPayload, Depends(get_current_user)], db: Annotated[Session, Depends(get_db)]):
     deps.monitoring_service.increment_request_count()
-    session = deps.session_service.get_session(session_id)
+    session = deps.session_service.get_session(session_id, db=db)
 
     if not session:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
@@ -101,9 +162,9 @@ async def get_session_history(session_id: str, current_user: Annotated[TokenPayl
 
 
 @router.delete("/history/{session_id}")
-async def delete_session(session_id: str, current_user: Annotated[TokenPayload, Depends(get_current_user)]):
+async def delete_session(session_id: str, current_user: Annotated[TokenPayload, Depends(get_current_user)], db: Annotated[Session, Depends(get_db)]):
     deps.monitoring_service.increment_request_count()
-    success = deps.session_service.delete_session(session_id, current_user.sub)
+    success = deps.session_service.delete_session(session_id, current_user.sub, db=db)
 
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
@@ -114,7 +175,8 @@ async def delete_session(session_id: str, current_user: Annotated[TokenPayload,
 @router.post("/stream")
 async def send_message_stream(
     request: ChatRequest,
-    current_user: Annotated[TokenPayload, Depends(get_current_user)]
+    current_user: Annotated[TokenPayload, Depends(get_current_user)],
+    db: Annotated[Session, Depends(get_db)]
 ):
     deps.monitoring_service.increment_request_count()
     
@@ -123,20 +185,23 @@ async def send_message_stream(
 
     # FIX: Ensure session_id is properly initialized
     session_id = request.session_id
+    conversation_history = []
     if not session_id:
         # Create new session for this user
-        session_id = deps.session_service.create_session(current_user.sub)
+        session_id = deps.session_service.create_session(current_user.sub, db=db)
         print(f"[DEBUG] Created new session: {session_id}")
     else:
-        # Validate existing session ownership
-        session = deps.session_service.get_session(session_id)
-        if not session:
+        # Validate existing session ownership (owner column only)
+        owner = deps.session_service.get_session_owner(session_id, db=db)
+        if owner is None:
             print(f"[ERROR] Session not found: {session_id}")
             raise HTTPException(status_code=404, detail="Session not found")
-        if session.user_id != current_user.sub:
-            print(f"[ERROR] Access denied - session owner: {session.user_id}, requester: {current_user.sub}")
+        if owner != current_user.sub:
+            print(f"[ERROR] Access denied - session owner: {owner}, requester: {current_user.sub}")
             raise HTTPException(status_code=403, detail="Access denied to this session")
         print(f"[DEBUG] Validated existing session: {session_id}")
+        # Recent history only, loaded with a bounded query
+        conversation_history = deps.session_service.get_recent_messages(session_id, limit=5, db=db)
 
     # FIX: Add user message BEFORE streaming starts
     try:
@@ -145,7 +210,8 @@ async def send_message_stream(
             user_id=current_user.sub,
             role="user",
             content=request.prompt,
-            tokens_used=None
+            tokens_used=None,
+            db=db
         )
         print(f"[DEBUG] Added user message to session {session_id}")
     except ValueError as e:
@@ -156,11 +222,6 @@ async def send_message_stream(
         print(f"[ERROR] Unexpected error adding user message: {type(e).__name__}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to save message: {str(e)}")
 
-    # Get conversation history (excluding the message we just added)
-    session = deps.session_service.get_session(session_id)
-    conversation_history = session.messages if session else []
-    conversation_history = conversation_history[:-1][-5:]
-
     system_prompt = load_system_prompt("prompt.txt")
     formatted_prompt = build_prompt(conversation_history, system_prompt, request.prompt)
 
@@ -168,19 +229,16 @@ async def send_message_stream(
         full_response = ""
         message_id = str(uuid.uuid4())
         cached = False
+        tokens_used = 0
 
         try:
             print(f"[DEBUG] Starting stream generation for session {session_id}")
-            yield f"data: {json.dumps({'type': 'start', 'session_id': session_id, 'message_id': message_id})}\n\n"
+            yield _START_TMPL % (session_id.encode(), message_id.encode())
 
-            cache_key = build_cache_key(
-                current_user.sub,
-                session_id,
-                formatted_prompt,
-                prev_response=None
-            )
+            # Key on the new turn and the history it follows, not the session
+            cache_key = build_cache_key(current_user.sub, request.prompt, history=conversation_history, system_prompt=system_prompt)
 
-            cached_response = deps.cache_manager.get(
+            cached_response = await deps.cache_manager.get(
                 cache_key,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature
@@ -192,7 +250,8 @@ async def send_message_stream(
                 full_response = cached_response
                 for i, word in enumerate(cached_response.split(' ')):
                     token = word if i == 0 else ' ' + word
-                    yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+                    tokens_used += 1
+                    yield _sse({'type': 'token', 'content': token})
                     await asyncio.sleep(0.01)
             else:
                 print(f"[DEBUG] Generating new response for session {session_id}")
@@ -200,21 +259,32 @@ async def send_message_stream(
                     token_stream = deps.inference_service.stream_infer(
                         prompt=formatted_prompt,
                         max_tokens=request.max_tokens,
-                        temperature=request.temperature
+                        temperature=request.temperature,
+                        session_id=session_id
                     )
 
-                    token_count = 0
-                    for token in token_stream:
+                    # Coalesce tokens into one frame per batch or flush interval
+                    loop = asyncio.get_running_loop()
+                    pending = []
+                    last_flush = loop.time()
+                    async for token in token_stream:
                         if token:
                             full_response += token
-                            token_count += 1
-                            yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
-                            await asyncio.sleep(0)
-                    
-                    print(f"[DEBUG] Generated {token_count} tokens for session {session_id}")
+                            tokens_used += 1
+                            pending.append(token)
+                            now = loop.time()
+                            if len(pending) >= _TOKEN_BATCH_SIZE or now - last_flush >= _TOKEN_FLUSH_INTERVAL:
+                                yield _sse({'type': 'token', 'content': ''.join(pending)})
+                                pending.clear()
+                                last_flush = now
+                                await asyncio.sleep(0)
+                    if pending:
+                        yield _sse({'type': 'token', 'content': ''.join(pending)})
+
+                    print(f"[DEBUG] Generated {tokens_used} tokens for session {session_id}")
 
                     if full_response:
-                        deps.cache_manager.set(
+                        await deps.cache_manager.set(
                             cache_key,
                             full_response,
                             max_tokens=request.max_tokens,
@@ -224,27 +294,21 @@ async def send_message_stream(
                 except Exception as e:
                     error_msg = f"Generation error: {type(e).__name__}: {str(e)}"
                     print(f"[ERROR] {error_msg}")
-                    yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                    yield _sse_error(str(e))
                     return
 
-            # FIX: Add assistant message with proper error handling
-            try:
-                tokens_used = len(full_response.split())
-                deps.session_service.add_message(
-                    session_id=session_id,
-                    user_id=current_user.sub,  # Use current_user.sub consistently
-                    role="assistant",
-                    content=full_response,
-                    tokens_used=tokens_used
-                )
-                print(f"[DEBUG] Saved assistant message to session {session_id}")
-            except ValueError as e:
-                # Log error but don't fail the stream
-                print(f"[WARNING] Failed to save assistant message: {str(e)}")
-            except Exception as e:
-                print(f"[ERROR] Unexpected error saving assistant message: {type(e).__name__}: {str(e)}")
-
-            yield f"data: {json.dumps({'type': 'done', 'tokens_used': len(full_response.split()), 'cached': cached, 'timestamp': datetime.utcnow().isoformat()})}\n\n"
+            # Save the assistant message in the background; failures are logged, not streamed
+            now = datetime.utcnow()
+            save_message_in_background(
+                session_id=session_id,
+                user_id=current_user.sub,  # Use current_user.sub consistently
+                role="assistant",
+                content=full_response,
+                tokens_used=tokens_used,
+                timestamp=now
+            )
+
+            yield _DONE_TMPL % (tokens_used, b"true" if cached else b"false", now.isoformat().encode())
             print(f"[DEBUG] Stream completed for session {session_id}")
             
         except Exception as e:
@@ -252,7 +316,7 @@ async def send_message_stream(
             print(f"[ERROR] {error_msg}")
             import traceback
             traceback.print_exc()
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield _sse_error(str(e))
 
     return StreamingResponse(
         generate_stream(),
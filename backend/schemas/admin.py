@@ -29,6 +29,8 @@ class ModelConfig(BaseModel):
     n_ctx: int
     n_threads: int
     n_gpu_layers: int
+    n_batch: int
+    n_ubatch: int
     temperature: float
     top_p: float
     max_tokens: int
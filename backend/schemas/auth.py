@@ -1,16 +1,20 @@
 """Authentication schemas."""
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from typing import Optional
 
 
 class LoginRequest(BaseModel):
     """Request schema for user login."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     username: str
     password: str
 
 
 class LoginResponse(BaseModel):
     """Response schema for successful login."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     access_token: str
     token_type: str = "bearer"
     user_id: str
@@ -20,33 +24,51 @@ class LoginResponse(BaseModel):
 
 class TokenPayload(BaseModel):
     """JWT token payload schema."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     sub: str  # user_id
     username: str
     is_admin: bool
     exp: int  # expiration timestamp
 
 
-class User(BaseModel):
-    """User model."""
+class UserPublic(BaseModel):
+    """User model without credentials."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     user_id: str
     username: str
-    password_hash: str
     is_admin: bool = False
 
+    @classmethod
+    def from_model(cls, m) -> "UserPublic":
+        """Build from a trusted ORM row, skipping validation."""
+        return cls.model_construct(
+            user_id=m.user_id,
+            username=m.username,
+            is_admin=m.is_admin
+        )
+
 
 class RegisterRequest(BaseModel):
     """Request schema for user registration."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     username: str
     password: str
 
 
 class ChangePasswordRequest(BaseModel):
     """Request schema for changing password."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     old_password: str
     new_password: str
 
 
 class ChangePasswordResponse(BaseModel):
     """Response schema for password change."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     success: bool
     message: str
@@ -1,11 +1,13 @@
 """Chat schemas."""
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 from datetime import datetime
 
 
 class ChatMessage(BaseModel):
     """Chat message schema."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     message_id: str
     session_id: str
     user_id: str
@@ -17,6 +19,8 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     """Request schema for chat message."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     prompt: str
     session_id: Optional[str] = None
     max_tokens: Optional[int] = None
@@ -25,6 +29,8 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     """Response schema for chat message."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     message_id: str
     session_id: str
     response: str
@@ -35,6 +41,8 @@ class ChatResponse(BaseModel):
 
 class ChatHistory(BaseModel):
     """Chat history schema."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     session_id: str
     user_id: str
     messages: List[ChatMessage]
@@ -1,48 +1,50 @@
 """Cache manager service using Redis for prompt caching with in-memory fallback."""
-from typing import Optional, Dict
-import hashlib
-import json
+from typing import Optional
+from collections import OrderedDict
+from cachetools import TTLCache
+import asyncio
+import time
 from config import settings
-from datetime import datetime, timedelta
 
 try:
     import redis
+    import redis.asyncio as aioredis
     REDIS_AVAILABLE = True
 except ImportError:
     REDIS_AVAILABLE = False
 
-
 class CacheManager:
-    """Manages caching of LLM inference results using Redis with in-memory fallback."""
+    """Manages caching of LLM inference results using Redis with in-memory fallback.
+
+    Entries are looked up by `key`, an already-hashed digest (see
+    build_cache_key); the manager only adds the sampling parameters.
+    """
 
     def __init__(self):
         """Initialize cache manager."""
         self.ttl = settings.CACHE_TTL_SECONDS
-        self.redis_client: Optional[redis.Redis] = None
+        self.redis_client: Optional[aioredis.Redis] = None
         self.use_redis = False
 
-        # In-memory cache fallback
-        self.memory_cache: Dict[str, tuple[str, datetime]] = {}
+        # Bounded in-memory cache fallback (LRU eviction + per-entry TTL)
+        self.memory_cache: TTLCache = TTLCache(maxsize=settings.CACHE_MAX_ENTRIES, ttl=self.ttl)
+        self._sweep_interval = 60
+        self._sweep_task: Optional[asyncio.Task] = None
+
+        # Small in-process LRU in front of Redis for the hottest keys
+        self._l1: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+        self._l1_capacity = 256
 
-        # Try to connect to Redis if available
+        # Create the async Redis client; the connection is verified in connect()
         if settings.ENABLE_CACHE and REDIS_AVAILABLE:
-            try:
-                self.redis_client = redis.Redis(
-                    host=settings.REDIS_HOST,
-                    port=settings.REDIS_PORT,
-                    db=settings.REDIS_DB,
-                    password=settings.REDIS_PASSWORD,
-                    decode_responses=True,
-                    socket_connect_timeout=5
-                )
-                # Test connection
-                self.redis_client.ping()
-                self.use_redis = True
-                print("✓ Redis cache enabled")
-            except (redis.ConnectionError, redis.TimeoutError, Exception) as e:
-                print(f"⚠ Redis unavailable ({e}). Using in-memory cache fallback.")
-                self.redis_client = None
-                self.use_redis = False
+            self.redis_client = aioredis.Redis(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                password=settings.REDIS_PASSWORD,
+                decode_responses=True,
+                socket_connect_timeout=5
+            )
         else:
             print("⚠ Redis not installed. Using in-memory cache fallback.")
 
@@ -52,46 +54,106 @@ class CacheManager:
         self.hits = 0
         self.misses = 0
 
-    def _generate_cache_key(self, prompt: str, **kwargs) -> str:
-        """Generate cache key from prompt and parameters."""
-        # Handle both string prompts and pre-built cache keys
-        if isinstance(prompt, str) and prompt.startswith('{'):
-            # Already a JSON cache key
+    async def connect(self):
+        """Check the Redis connection, falling back to the in-memory cache."""
+        self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+        if not self.redis_client:
+            return
+
+        try:
+            await self.redis_client.ping()
+            self.use_redis = True
+            print("✓ Redis cache enabled")
+        except (redis.ConnectionError, redis.TimeoutError, Exception) as e:
+            print(f"⚠ Redis unavailable ({e}). Using in-memory cache fallback.")
+            await self.redis_client.aclose()
+            self.redis_client = None
+            self.use_redis = False
+
+    async def close(self):
+        """Stop the sweeper and close the Redis connection pool."""
+        if self._sweep_task:
+            self._sweep_task.cancel()
             try:
-                json.loads(prompt)  # Validate it's valid JSON
-                return f"llm:{hashlib.sha256(prompt.encode()).hexdigest()}"
-            except json.JSONDecodeError:
+                await self._sweep_task
+            except asyncio.CancelledError:
                 pass
-        
-        # Build cache key from parameters
-        cache_data = {
-            "prompt": prompt,
-            "temperature": kwargs.get("temperature", settings.MODEL_TEMPERATURE),
-            "max_tokens": kwargs.get("max_tokens", settings.MODEL_MAX_TOKENS),
-        }
-        cache_str = json.dumps(cache_data, sort_keys=True)
-        return f"llm:{hashlib.sha256(cache_str.encode()).hexdigest()}"
+        if self.redis_client:
+            await self.redis_client.aclose()
+
+    def _generate_cache_key(self, key: str, **kwargs) -> str:
+        """Redis key: sampling parameters as a prefix to the digest, no re-hashing."""
+        temperature = kwargs.get("temperature", settings.MODEL_TEMPERATURE)
+        max_tokens = kwargs.get("max_tokens", settings.MODEL_MAX_TOKENS)
+        return f"llm:{temperature}:{max_tokens}:{key}"
+
+    def _local_key(self, key: str, **kwargs) -> tuple:
+        """Key for the in-process tiers: a plain tuple, no string building."""
+        return (
+            kwargs.get("temperature", settings.MODEL_TEMPERATURE),
+            kwargs.get("max_tokens", settings.MODEL_MAX_TOKENS),
+            key
+        )
 
     def _clean_expired_entries(self):
         """Remove expired entries from in-memory cache."""
-        now = datetime.utcnow()
-        expired_keys = [key for key, (_, expiry) in self.memory_cache.items() if expiry < now]
-        for key in expired_keys:
-            del self.memory_cache[key]
+        self.memory_cache.expire()
 
-    def get(self, prompt: str, **kwargs) -> Optional[str]:
-        """Get cached response for a prompt."""
+    async def _sweep_loop(self):
+        """Drop expired in-memory entries in the background instead of per request."""
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            self._clean_expired_entries()
+
+    def _l1_get(self, cache_key: tuple) -> Optional[str]:
+        """Look up a key in the in-process LRU, dropping it if expired."""
+        entry = self._l1.get(cache_key)
+        if entry is None:
+            return None
+        value, expiry = entry
+        if expiry <= time.monotonic():
+            del self._l1[cache_key]
+            return None
+        self._l1.move_to_end(cache_key)
+        return value
+
+    def _l1_put(self, cache_key: tuple, value: str, ttl: Optional[float] = None):
+        """Insert a key into the in-process LRU, evicting the oldest entry.
+
+        `ttl` caps the local lifetime, e.g. to the Redis entry's remaining TTL.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._l1[cache_key] = (value, time.monotonic() + ttl)
+        self._l1.move_to_end(cache_key)
+        if len(self._l1) > self._l1_capacity:
+            self._l1.popitem(last=False)
+
+    async def get(self, key: str, **kwargs) -> Optional[str]:
+        """Get cached response for a key."""
         if not self.enabled:
             return None
 
         try:
-            cache_key = self._generate_cache_key(prompt, **kwargs)
+            local_key = self._local_key(key, **kwargs)
 
-            # Try Redis first
+            # Try Redis first, fronted by the in-process LRU
             if self.use_redis and self.redis_client:
+                cached_value = self._l1_get(local_key)
+                if cached_value is not None:
+                    self.hits += 1
+                    return cached_value
                 try:
-                    cached_value = self.redis_client.get(cache_key)
+                    # Only the Redis tier needs the key as a string. GET and PTTL
+                    # share one round-trip so the local copy never outlives the entry
+                    redis_key = self._generate_cache_key(key, **kwargs)
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    pipe.get(redis_key)
+                    pipe.pttl(redis_key)
+                    cached_value, pttl_ms = await pipe.execute()
                     if cached_value:
+                        # PTTL -1 means no expiry: fall back to the default local TTL
+                        self._l1_put(local_key, cached_value, ttl=None if pttl_ms == -1 else max(pttl_ms, 0) / 1000)
                         self.hits += 1
                         return cached_value
                     else:
@@ -101,16 +163,11 @@ class CacheManager:
                     print(f"[Cache] Redis get error: {e}")
                     # Fall through to memory cache
 
-            # Use in-memory cache
-            self._clean_expired_entries()
-            if cache_key in self.memory_cache:
-                value, expiry = self.memory_cache[cache_key]
-                if expiry > datetime.utcnow():
-                    self.hits += 1
-                    return value
-                else:
-                    # Expired
-                    del self.memory_cache[cache_key]
+            # Use in-memory cache; TTLCache drops the key if it has expired
+            value = self.memory_cache.get(local_key)
+            if value is not None:
+                self.hits += 1
+                return value
 
             self.misses += 1
             return None
@@ -119,32 +176,32 @@ class CacheManager:
             self.misses += 1
             return None
 
-    def set(self, prompt: str, response: str, **kwargs) -> bool:
-        """Cache a response for a prompt."""
+    async def set(self, key: str, response: str, **kwargs) -> bool:
+        """Cache a response for a key."""
         if not self.enabled:
             return False
 
         try:
-            cache_key = self._generate_cache_key(prompt, **kwargs)
+            local_key = self._local_key(key, **kwargs)
 
             # Try Redis first
             if self.use_redis and self.redis_client:
                 try:
-                    self.redis_client.setex(cache_key, self.ttl, response)
+                    await self.redis_client.setex(self._generate_cache_key(key, **kwargs), self.ttl, response)
+                    self._l1_put(local_key, response)
                     return True
                 except Exception as e:
                     print(f"[Cache] Redis set error: {e}")
                     # Fall through to memory cache
 
             # Use in-memory cache
-            expiry = datetime.utcnow() + timedelta(seconds=self.ttl)
-            self.memory_cache[cache_key] = (response, expiry)
+            self.memory_cache[local_key] = response
             return True
         except Exception as e:
             print(f"[Cache] Set error: {type(e).__name__}: {str(e)}")
             return False
 
-    def flush(self) -> int:
+    async def flush(self) -> int:
         """Flush all cache entries (admin operation)."""
         if not self.enabled:
             return 0
@@ -154,20 +211,29 @@ class CacheManager:
         # Flush Redis
         if self.use_redis and self.redis_client:
             try:
-                keys = self.redis_client.keys("llm:*")
-                if keys:
-                    count = self.redis_client.delete(*keys)
+                # Cursor-based SCAN + UNLINK avoids blocking Redis on large keyspaces
+                pipe = self.redis_client.pipeline(transaction=False)
+                pending = 0
+                async for key in self.redis_client.scan_iter(match="llm:*", count=500):
+                    pipe.unlink(key)
+                    pending += 1
+                    if pending >= 500:
+                        count += sum(await pipe.execute())
+                        pending = 0
+                if pending:
+                    count += sum(await pipe.execute())
             except Exception as e:
                 print(f"[Cache] Redis flush error: {e}")
 
-        # Flush in-memory cache
+        # Flush in-process LRU and in-memory cache
+        self._l1.clear()
         memory_count = len(self.memory_cache)
         self.memory_cache.clear()
         count += memory_count
 
         return count
 
-    def get_stats(self) -> dict:
+    async def get_stats(self) -> dict:
         """Get cache statistics."""
         total = self.hits + self.misses
         hit_rate = (self.hits / total * 100) if total > 0 else 0
@@ -183,13 +249,13 @@ class CacheManager:
 
         if self.use_redis and self.redis_client:
             try:
-                info = self.redis_client.info("memory")
+                info = await self.redis_client.info("memory")
                 stats["memory_used"] = info.get("used_memory_human", "N/A")
-                stats["entries"] = self.redis_client.dbsize()
+                stats["entries"] = await self.redis_client.dbsize()
             except Exception:
                 pass
         else:
-            # In-memory cache stats
+            # In-memory cache stats; expire() only touches already-expired entries
             self._clean_expired_entries()
             stats["entries"] = len(self.memory_cache)
 
@@ -1,39 +1,173 @@
-from typing import Optional, Iterator
+from typing import Optional, Iterator, AsyncIterator
+from collections import OrderedDict
 from config import settings
+import asyncio
+import ctypes
+import hashlib
 import os
-import time
+import re
+
+# Quantization tag at the end of a GGUF file stem, e.g. "llama-3-8b.Q3_K_M"
+_QUANT_SUFFIX_RE = re.compile(r"[.-](?:I?Q\d(?:_[0-9A-Z]+)*|F16|F32|BF16)$", re.IGNORECASE)
+
+# Response cleanup patterns, compiled once
+_THINK_RE = re.compile(r"<think>.*?</think>", re.IGNORECASE | re.DOTALL)
+_EOT_RE = re.compile(r"<\|eot_id\|>")
+_S_RE = re.compile(r"</s>")
+_REASON_RE = re.compile(
+    r"(let me|i need to|i remember|wait[, ]|first[, ]|maybe|another thing"
+    r"|i'm trying to|now,|let's|in conclusion)",
+    re.IGNORECASE
+)
+
+
+def _cuda_compute_capability() -> Optional[tuple[int, int]]:
+    """Compute capability of GPU 0 via the CUDA driver API, or None without CUDA."""
+    try:
+        cuda = ctypes.CDLL("libcuda.so.1")
+    except OSError:
+        return None
+    device, major, minor = ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+    if cuda.cuInit(0) != 0 or cuda.cuDeviceGet(ctypes.byref(device), 0) != 0:
+        return None
+    # CU_DEVICE_ATTRIBUTE_COMPUTE_CAPABILITY_MAJOR = 75, _MINOR = 76
+    if (cuda.cuDeviceGetAttribute(ctypes.byref(major), 75, device) != 0
+            or cuda.cuDeviceGetAttribute(ctypes.byref(minor), 76, device) != 0):
+        return None
+    return major.value, minor.value
+
+
+def _use_tensorcore_build() -> bool:
+    """Tensor cores (Turing and newer) need a build without forced MMQ kernels."""
+    if settings.MODEL_TENSORCORE_BUILD is not None:
+        return settings.MODEL_TENSORCORE_BUILD
+    capability = _cuda_compute_capability()
+    return capability is not None and capability >= (7, 5)
+
 
 try:
-    from llama_cpp import Llama
+    if _use_tensorcore_build():
+        try:
+            import llama_cpp_cuda_tensorcore as llama_cpp
+        except ImportError:
+            import llama_cpp
+    else:
+        import llama_cpp
+    Llama = llama_cpp.Llama
     LLAMA_CPP_AVAILABLE = True
 except ImportError:
     LLAMA_CPP_AVAILABLE = False
 
+# Probe once whether this llama.cpp build can offload layers (CUDA/Metal/etc.)
+try:
+    GPU_OFFLOAD_AVAILABLE = LLAMA_CPP_AVAILABLE and bool(llama_cpp.llama_supports_gpu_offload())
+except AttributeError:
+    GPU_OFFLOAD_AVAILABLE = False
+
+
+def _resolve_gpu_layers() -> int:
+    """Explicit MODEL_N_GPU_LAYERS wins; otherwise offload everything when supported."""
+    n = settings.MODEL_N_GPU_LAYERS
+    if n is not None and n >= 0:
+        return n
+    return -1 if GPU_OFFLOAD_AVAILABLE else 0
+
+
+def _resolve_model_path(path: str, quant: Optional[str]) -> str:
+    """Prefer a sibling GGUF with the configured quantization, e.g. model.Q4_K_M.gguf."""
+    if not quant:
+        return path
+    directory, filename = os.path.split(path)
+    stem, ext = os.path.splitext(filename)
+    candidate = os.path.join(directory, f"{_QUANT_SUFFIX_RE.sub('', stem)}.{quant}{ext or '.gguf'}")
+    return candidate if os.path.exists(candidate) else path
+
+
+def _resolve_threads() -> int:
+    """Explicit MODEL_N_THREADS wins; otherwise use the CPUs this process may run on."""
+    if settings.MODEL_N_THREADS:
+        return settings.MODEL_N_THREADS
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+async def _aiter_tokens(tokens) -> AsyncIterator[str]:
+    """Adapt a sync token iterator (or a one-shot error string) for `async for`."""
+    if isinstance(tokens, str):
+        yield tokens
+        return
+    try:
+        for token in tokens:
+            yield token
+    finally:
+        # Run the engine generator's cleanup now if the consumer stops early
+        close = getattr(tokens, "close", None)
+        if close:
+            close()
+
+
+def _parse_tensor_split() -> Optional[list[float]]:
+    if not settings.MODEL_TENSOR_SPLIT:
+        return None
+    return [float(x) for x in settings.MODEL_TENSOR_SPLIT.split(",") if x.strip()]
+
 
 class LLMEngine:
     def __init__(self):
         self.model: Optional[Llama] = None
         self.model_loaded = False
         self.model_path = settings.MODEL_PATH
+        self.n_threads = _resolve_threads()
+        self.n_gpu_layers = _resolve_gpu_layers()
+        self.tensor_split = _parse_tensor_split()
+
+        # session_id -> saved llama state; the model itself holds _active_session's KV
+        self._session_states: OrderedDict[str, object] = OrderedDict()
+        self._active_session: Optional[str] = None
+
+    def _restore_session(self, session_id: Optional[str]):
+        """Load the session's KV state so llama.cpp only prefills the new suffix."""
+        if not session_id or session_id == self._active_session:
+            return
+        state = self._session_states.get(session_id)
+        if state is not None:
+            self.model.load_state(state)
+            self._session_states.move_to_end(session_id)
+            self._active_session = session_id
+
+    def _save_session(self, session_id: Optional[str]):
+        """Snapshot the KV state after a turn, evicting the least recently used session."""
+        self._active_session = session_id
+        if not session_id or settings.MODEL_SESSION_STATES <= 0:
+            return
+        self._session_states[session_id] = self.model.save_state()
+        self._session_states.move_to_end(session_id)
+        while len(self._session_states) > settings.MODEL_SESSION_STATES:
+            self._session_states.popitem(last=False)
 
     def load_model(self) -> bool:
         if not LLAMA_CPP_AVAILABLE:
             print("llama-cpp-python not available. Model loading disabled.")
             return False
 
+        self.model_path = _resolve_model_path(self.model_path, settings.MODEL_QUANT)
         if not os.path.exists(self.model_path):
             print(f"Model file not found: {self.model_path}")
             print("Please download a model and place it in the correct location.")
             return False
 
         try:
-            print(f"Loading model from {self.model_path}...")
+            print(f"Loading model from {self.model_path} (n_gpu_layers={self.n_gpu_layers})...")
             self.model = Llama(
                 model_path=self.model_path,
                 n_ctx=settings.MODEL_N_CTX,
-                n_threads=settings.MODEL_N_THREADS,
-                n_gpu_layers=settings.MODEL_N_GPU_LAYERS,
+                n_threads=self.n_threads,
+                n_threads_batch=self.n_threads,
+                n_gpu_layers=self.n_gpu_layers,
+                tensor_split=self.tensor_split,
                 n_batch=settings.MODEL_N_BATCH,
+                n_ubatch=settings.MODEL_N_UBATCH,
                 add_bos_token=True,
                 verbose=True
             )
@@ -52,8 +186,12 @@ class LLMEngine:
         prompt: str,
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
-        stream: bool = False
-    ) -> str | Iterator[str]:
+        stream: bool = False,
+        session_id: Optional[str] = None
+    ) -> str | Iterator[str] | AsyncIterator[str]:
+
+        if not stream:
+            return self.complete(prompt, max_tokens=max_tokens, temperature=temperature, session_id=session_id)[0]
 
         if not self.model_loaded or not self.model:
             return self._mock_generate(prompt, stream)
@@ -65,76 +203,105 @@ class LLMEngine:
                 temperature=temperature if temperature is not None else settings.MODEL_TEMPERATURE,
                 top_p=settings.MODEL_TOP_P,
                 echo=False,
-                stream=stream,
+                stream=True,
                 stop=["<|eot_id|>"],
                 repeat_penalty=1.1
             )
-
-            if stream:
-                return self._stream_output(output)
-            else:
-                response = output['choices'][0]['text'].strip()
-                response = self._clean_response(response)
-                return response
+            return self._stream_output(output, session_id)
 
         except Exception as e:
             print(f"Generation error: {e}")
             return f"Error generating response: {str(e)}"
 
-    def _stream_output(self, output) -> Iterator[str]:
+    def complete(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        session_id: Optional[str] = None
+    ) -> tuple[str, int]:
+        """Non-streaming generation returning (text, completion token count)."""
+        if not self.model_loaded or not self.model:
+            response = self._mock_generate(prompt, stream=False)
+            return response, response.count(" ") + 1
+
+        try:
+            self._restore_session(session_id)
+            output = self.model(
+                prompt,
+                max_tokens=max_tokens or settings.MODEL_MAX_TOKENS,
+                temperature=temperature if temperature is not None else settings.MODEL_TEMPERATURE,
+                top_p=settings.MODEL_TOP_P,
+                echo=False,
+                stream=False,
+                stop=["<|eot_id|>"],
+                repeat_penalty=1.1
+            )
+            self._save_session(session_id)
+            response = self._clean_response(output['choices'][0]['text'].strip())
+            return response, output['usage']['completion_tokens']
+
+        except Exception as e:
+            # The context no longer matches any tracked session
+            self._active_session = None
+            print(f"Generation error: {e}")
+            return f"Error generating response: {str(e)}", 0
+
+    def _stream_output(self, output, session_id: Optional[str] = None) -> Iterator[str]:
         buffer = ""
         full_text = ""
         first_token = True
 
-        for chunk in output:
-            token = chunk['choices'][0]['text']
-            if not token or token.strip().lower() in ["<think>", "</think>"]:
-                continue
-
-            full_text += token
-
-            if first_token:
-                buffer += token
-                cleaned = self._clean_response(buffer)
-                if cleaned:
-                    yield cleaned
-                buffer = ""
-                first_token = False
+        # The completion is lazy: the prompt is evaluated on the first iteration
+        self._restore_session(session_id)
+        completed = False
+        try:
+            for chunk in output:
+                token = chunk['choices'][0]['text']
+                if not token or token.strip().lower() in ["<think>", "</think>"]:
+                    continue
+
+                full_text += token
+
+                if first_token:
+                    buffer += token
+                    cleaned = self._clean_response(buffer)
+                    if cleaned:
+                        yield cleaned
+                    buffer = ""
+                    first_token = False
+                else:
+                    yield token
+            completed = True
+        finally:
+            if completed:
+                self._save_session(session_id)
             else:
-                yield token
+                # Client dropped the stream (or it failed) mid-generation: the
+                # context holds a partial turn, so don't treat it as any session's
+                self._active_session = None
 
     def _clean_response(self, text: str) -> str:
-        import re
         if not text:
             return text
 
-        text = re.sub(r"(?is)<think>.*?</think>", "", text)
-        text = re.sub(r"<\|eot_id\|>", "", text)
-        text = re.sub(r"</s>", "", text)
-
-        lines = [l.strip() for l in text.split("\n") if l.strip()]
-
-        reasoning_markers = [
-            r"let me", r"i need to", r"i remember", r"wait[, ]",
-            r"first[, ]", r"maybe", r"another thing",
-            r"i'm trying to", r"now,", r"let's", r"in conclusion"
-        ]
-        rm = re.compile(r"(?i)(" + "|".join(reasoning_markers) + ")")
-
-        clean_lines = []
-        for line in lines:
-            if rm.search(line):
-                continue
-            clean_lines.append(line)
+        text = _THINK_RE.sub("", text)
+        text = _EOT_RE.sub("", text)
+        text = _S_RE.sub("", text)
 
+        # One pass: strip, drop blanks and reasoning lines, dedup in order
+        seen = set()
         final = []
-        for l in clean_lines:
-            if l not in final:
-                final.append(l)
+        for line in text.split("\n"):
+            line = line.strip()
+            if not line or line in seen or _REASON_RE.search(line):
+                continue
+            seen.add(line)
+            final.append(line)
 
-        return "\n".join(final).strip()
+        return "\n".join(final)
 
-    def _mock_generate(self, prompt: str, stream: bool) -> str | Iterator[str]:
+    def _mock_generate(self, prompt: str, stream: bool) -> str | AsyncIterator[str]:
         user_query = "your question"
         marker = "<|start_header_id|>user<|end_header_id|>"
         if marker in prompt:
@@ -151,9 +318,12 @@ class LLMEngine:
 
         if stream:
             words = response.split(' ')
-            def word_generator():
+            delay = settings.MOCK_STREAM_DELAY
+            async def word_generator():
                 for i, w in enumerate(words):
-                    time.sleep(0.05)
+                    # Yield to the event loop instead of blocking it
+                    if delay:
+                        await asyncio.sleep(delay)
                     yield (w if i == 0 else " " + w)
             return word_generator()
 
@@ -164,9 +334,11 @@ class LLMEngine:
             "model_path": self.model_path,
             "model_loaded": self.model_loaded,
             "n_ctx": settings.MODEL_N_CTX,
-            "n_threads": settings.MODEL_N_THREADS,
-            "n_gpu_layers": settings.MODEL_N_GPU_LAYERS,
+            "n_threads": self.n_threads,
+            "n_gpu_layers": self.n_gpu_layers,
+            "tensor_split": self.tensor_split,
             "n_batch": settings.MODEL_N_BATCH,
+            "n_ubatch": settings.MODEL_N_UBATCH,
             "temperature": settings.MODEL_TEMPERATURE,
             "top_p": settings.MODEL_TOP_P,
             "max_tokens": settings.MODEL_MAX_TOKENS
@@ -178,18 +350,30 @@ class ModelInferenceService:
         self.cache_manager = cache_manager
         self.llm_engine = llm_engine
 
-    def infer(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None, use_cache: bool = True) -> tuple[str, bool]:
+    async def infer(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None, use_cache: bool = True, cache_key: Optional[str] = None, session_id: Optional[str] = None) -> tuple[str, bool, int]:
+        """
+        Return (response, cached, tokens_used).
+
+        `cache_key` (see build_cache_key) keys the response cache on the
+        session turn instead of the full formatted prompt; without one the
+        prompt itself is hashed. `session_id` lets the engine reuse that
+        session's KV state.
+        """
+        if use_cache and cache_key is None:
+            cache_key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
         if use_cache:
-            cached = self.cache_manager.get(prompt, max_tokens=max_tokens, temperature=temperature)
+            cached = await self.cache_manager.get(cache_key, max_tokens=max_tokens, temperature=temperature)
             if cached:
-                return cached, True
+                # No model token count for cached text; count words without splitting
+                return cached, True, cached.count(" ") + 1
 
-        response = self.llm_engine.generate(prompt, max_tokens=max_tokens, temperature=temperature, stream=False)
+        response, tokens_used = self.llm_engine.complete(prompt, max_tokens=max_tokens, temperature=temperature, session_id=session_id)
 
         if use_cache and isinstance(response, str):
-            self.cache_manager.set(prompt, response, max_tokens=max_tokens, temperature=temperature)
+            await self.cache_manager.set(cache_key, response, max_tokens=max_tokens, temperature=temperature)
 
-        return response, False
+        return response, False, tokens_used
 
-    def stream_infer(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> Iterator[str]:
-        return self.llm_engine.generate(prompt, max_tokens=max_tokens, temperature=temperature, stream=True)
+    def stream_infer(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        tokens = self.llm_engine.generate(prompt, max_tokens=max_tokens, temperature=temperature, stream=True, session_id=session_id)
+        return tokens if hasattr(tokens, "__aiter__") else _aiter_tokens(tokens)
@@ -1,7 +1,8 @@
 """Monitoring service for system metrics and telemetry."""
+import itertools
 import psutil
 from datetime import datetime
-from typing import Dict
+from typing import Any, Dict
 from schemas.admin import SystemMetrics
 
 
@@ -10,13 +11,33 @@ class MonitoringService:
 
     def __init__(self):
         """Initialize monitoring service."""
-        self.total_requests = 0
+        # next() on itertools.count is atomic under the GIL, so no lock is needed
+        self._counter = itertools.count(1)
+        self._last = 0
         self.start_time = datetime.utcnow()
 
+        # Snapshot served by admin endpoints, refreshed in the background
+        self.latest_metrics: Dict[str, Any] = {}
+
+        # Prime the CPU counter; later non-blocking reads report usage since the previous call
+        psutil.cpu_percent(interval=None)
+
+    def refresh_snapshot(self, cache_stats: dict, session_service):
+        """Recompute the admin metrics snapshot."""
+        total_sessions = session_service.get_total_sessions_count()
+        self.latest_metrics = {
+            "system": self.get_system_metrics(cache_stats, total_sessions),
+            "cache": cache_stats,
+            "sessions": {
+                "total_sessions": total_sessions,
+                "total_users": session_service.get_total_users_count()
+            }
+        }
+
     def get_system_metrics(self, cache_stats: dict, active_sessions: int) -> SystemMetrics:
         """Get current system metrics."""
-        # CPU usage
-        cpu_usage = psutil.cpu_percent(interval=0.1)
+        # CPU usage over the interval since the last refresh (non-blocking)
+        cpu_usage = psutil.cpu_percent(interval=None)
 
         # Memory usage
         memory = psutil.virtual_memory()
@@ -37,9 +58,14 @@ class MonitoringService:
             uptime_seconds=uptime_seconds
         )
 
+    @property
+    def total_requests(self) -> int:
+        """Total requests handled so far."""
+        return self._last
+
     def increment_request_count(self):
         """Increment total request counter."""
-        self.total_requests += 1
+        self._last = next(self._counter)
 
     def get_uptime(self) -> float:
         """Get service uptime in seconds."""
@@ -4,6 +4,9 @@ from typing import List, Optional
 from schemas.chat import ChatMessage, ChatHistory
 from database import SessionLocal
 from database.models import Session as SessionModel, Message as MessageModel
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session, selectinload
+from contextlib import contextmanager
 import uuid
 
 
@@ -14,11 +17,22 @@ class SessionService:
         """Initialize session service."""
         pass
 
-    def create_session(self, user_id: str) -> str:
-        """Create a new chat session for a user."""
-        session_id = str(uuid.uuid4())
+    @contextmanager
+    def _db(self, db: Optional[Session] = None):
+        """Use the caller's request-scoped session, or open (and close) one."""
+        if db is not None:
+            yield db
+            return
         db = SessionLocal()
         try:
+            yield db
+        finally:
+            db.close()
+
+    def create_session(self, user_id: str, db: Optional[Session] = None) -> str:
+        """Create a new chat session for a user."""
+        session_id = str(uuid.uuid4())
+        with self._db(db) as db:
             session = SessionModel(
                 session_id=session_id,
                 user_id=user_id
@@ -26,13 +40,10 @@ class SessionService:
             db.add(session)
             db.commit()
             return session_id
-        finally:
-            db.close()
 
-    def get_session(self, session_id: str) -> Optional[ChatHistory]:
+    def get_session(self, session_id: str, db: Optional[Session] = None) -> Optional[ChatHistory]:
         """Get session by ID."""
-        db = SessionLocal()
-        try:
+        with self._db(db) as db:
             session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
             if not session:
                 return None
@@ -58,14 +69,22 @@ class SessionService:
                 created_at=session.created_at,
                 updated_at=session.updated_at
             )
-        finally:
-            db.close()
 
-    def get_user_sessions(self, user_id: str) -> List[ChatHistory]:
+    def get_session_owner(self, session_id: str, db: Optional[Session] = None) -> Optional[str]:
+        """Return the session's user_id, or None if it doesn't exist (no messages loaded)."""
+        with self._db(db) as db:
+            return db.query(SessionModel.user_id).filter(SessionModel.session_id == session_id).scalar()
+
+    def get_user_sessions(self, user_id: str, db: Optional[Session] = None) -> List[ChatHistory]:
         """Get all sessions for a user."""
-        db = SessionLocal()
-        try:
-            sessions = db.query(SessionModel).filter(SessionModel.user_id == user_id).all()
+        with self._db(db) as db:
+            # Load every session's messages in one batched IN query instead of one per session
+            sessions = (
+                db.query(SessionModel)
+                .options(selectinload(SessionModel.messages))
+                .filter(SessionModel.user_id == user_id)
+                .all()
+            )
 
             result = []
             for session in sessions:
@@ -91,8 +110,6 @@ class SessionService:
                 ))
 
             return result
-        finally:
-            db.close()
 
     def add_message(
         self,
@@ -100,30 +117,42 @@ class SessionService:
         user_id: str,
         role: str,
         content: str,
-        tokens_used: Optional[int] = None
+        tokens_used: Optional[int] = None,
+        timestamp: Optional[datetime] = None,
+        db: Optional[Session] = None
     ) -> ChatMessage:
-        """Add a message to a session."""
-        db = SessionLocal()
-        try:
-            session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
-            if not session:
+        """
+        Add a message to a session.
+
+        Pass `timestamp` to keep ordering when the write is deferred.
+        """
+        with self._db(db) as db:
+            # Touch the session and fetch its owner in one statement
+            owner = db.execute(
+                update(SessionModel)
+                .where(SessionModel.session_id == session_id)
+                .values(updated_at=datetime.utcnow())
+                .returning(SessionModel.user_id)
+            ).scalar()
+            if owner is None:
+                db.rollback()
                 raise ValueError(f"Session {session_id} not found")
 
-            if session.user_id != user_id:
+            if owner != user_id:
+                db.rollback()
                 raise ValueError("User does not own this session")
 
             message_id = str(uuid.uuid4())
-            message = MessageModel(
+            timestamp = timestamp or datetime.utcnow()
+            db.execute(insert(MessageModel).values(
                 message_id=message_id,
                 session_id=session_id,
                 user_id=user_id,
                 role=role,
                 content=content,
-                tokens_used=tokens_used
-            )
-
-            db.add(message)
-            session.updated_at = datetime.utcnow()
+                tokens_used=tokens_used,
+                timestamp=timestamp
+            ))
             db.commit()
 
             return ChatMessage(
@@ -132,16 +161,37 @@ class SessionService:
                 user_id=user_id,
                 role=role,
                 content=content,
-                timestamp=message.timestamp,
+                timestamp=timestamp,
                 tokens_used=tokens_used
             )
-        finally:
-            db.close()
 
-    def get_session_messages(self, session_id: str) -> List[ChatMessage]:
+    def get_recent_messages(self, session_id: str, limit: int = 6, db: Optional[Session] = None) -> List[ChatMessage]:
+        """Get the most recent messages in a session, oldest first."""
+        with self._db(db) as db:
+            # Load only the last `limit` messages instead of the full history
+            rows = (
+                db.query(MessageModel)
+                .filter(MessageModel.session_id == session_id)
+                .order_by(MessageModel.timestamp.desc())
+                .limit(limit)
+                .all()
+            )
+            return [
+                ChatMessage(
+                    message_id=msg.message_id,
+                    session_id=msg.session_id,
+                    user_id=msg.user_id,
+                    role=msg.role,
+                    content=msg.content,
+                    timestamp=msg.timestamp,
+                    tokens_used=msg.tokens_used
+                )
+                for msg in reversed(rows)
+            ]
+
+    def get_session_messages(self, session_id: str, db: Optional[Session] = None) -> List[ChatMessage]:
         """Get all messages in a session."""
-        db = SessionLocal()
-        try:
+        with self._db(db) as db:
             messages = db.query(MessageModel).filter(MessageModel.session_id == session_id).all()
             return [
                 ChatMessage(
@@ -155,13 +205,10 @@ class SessionService:
                 )
                 for msg in messages
             ]
-        finally:
-            db.close()
 
-    def delete_session(self, session_id: str, user_id: str) -> bool:
+    def delete_session(self, session_id: str, user_id: str, db: Optional[Session] = None) -> bool:
         """Delete a session."""
-        db = SessionLocal()
-        try:
+        with self._db(db) as db:
             session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
             if not session:
                 return False
@@ -172,33 +219,22 @@ class SessionService:
             db.delete(session)
             db.commit()
             return True
-        finally:
-            db.close()
 
-    def clear_all_sessions(self) -> int:
+    def clear_all_sessions(self, db: Optional[Session] = None) -> int:
         """Clear all sessions (admin operation)."""
-        db = SessionLocal()
-        try:
-            count = db.query(SessionModel).count()
-            db.query(SessionModel).delete()
+        with self._db(db) as db:
+            # DELETE reports the affected row count; no separate COUNT(*)
+            count = db.query(SessionModel).delete(synchronize_session=False)
             db.commit()
             return count
-        finally:
-            db.close()
 
-    def get_total_sessions_count(self) -> int:
+    def get_total_sessions_count(self, db: Optional[Session] = None) -> int:
         """Get total number of sessions in the database."""
-        db = SessionLocal()
-        try:
+        with self._db(db) as db:
             return db.query(SessionModel).count()
-        finally:
-            db.close()
 
-    def get_total_users_count(self) -> int:
+    def get_total_users_count(self, db: Optional[Session] = None) -> int:
         """Get total number of unique users with sessions."""
-        db = SessionLocal()
-        try:
+        with self._db(db) as db:
             from sqlalchemy import func
             return db.query(func.count(func.distinct(SessionModel.user_id))).scalar()
-        finally:
-            db.close()
@@ -1,25 +1,67 @@
-from typing import List, Optional
-import json, hashlib
+from typing import Final, Iterable, List, Optional
+from functools import lru_cache
+import hashlib, os, sys
 from config import settings
 
 def load_system_prompt(path="prompt.txt") -> str:
+    """Cached system prompt; the file is re-read only when its mtime changes."""
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            # Remove the template placeholders if they exist
-            content = content.replace("Instruction: {prompt}", "").strip()
-            content = content.replace("Response:", "").strip()
-            if not content:
-                return "You are a helpful AI assistant."
-            return content
-    except:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
         return "You are a helpful AI assistant."
+    return _read_system_prompt(path, mtime_ns)
+
+@lru_cache(maxsize=4)
+def _read_system_prompt(path: str, mtime_ns: int) -> str:
+    try:
+        # Raw fd read + one decode; no TextIOWrapper/BufferedReader for a small file
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            data = os.read(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        content = data.decode("utf-8")
+        if "\r" in content:
+            # Match text-mode universal newlines (prompt.txt ships with CRLF)
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+        content = content.strip()
+    except (OSError, UnicodeDecodeError):
+        return "You are a helpful AI assistant."
+    # Remove the template placeholders if they exist
+    content = content.replace("Instruction: {prompt}", "").strip()
+    content = content.replace("Response:", "").strip()
+    if not content:
+        return "You are a helpful AI assistant."
+    return content
+
+# Header tokens and roles recur in every message; keep one interned copy of each
+_HDR_START = sys.intern("<|start_header_id|>")
+_HDR_END = sys.intern("<|end_header_id|>")
+_ROLES = {r: sys.intern(r) for r in ("system", "user", "assistant")}
+
+# One chat block: header, content, newline
+_CHAT_TMPL = _HDR_START + "{}" + _HDR_END + "\n{}\n"
+
+# Fixed system header and trailing assistant header, built once at import
+_SYS_HDR: Final = _HDR_START + "system" + _HDR_END + "\n"
+_ASSIST_SUFFIX: Final = _HDR_START + "assistant" + _HDR_END + "\n"
+
+def _fmt_chat_raw(role: str, content: str) -> str:
+    """fmt_chat for content the caller has already stripped."""
+    return _CHAT_TMPL.format(_ROLES.get(role, role), content)
 
 def fmt_chat(role: str, content: str) -> str:
-    return (
-        f"<|start_header_id|>{role}<|end_header_id|>\n"
-        f"{content.strip()}\n"
-    )
+    return _fmt_chat_raw(role, content.strip())
+
+@lru_cache(maxsize=4)
+def _system_block(system_prompt: str) -> str:
+    """Formatted system header block; constant for a given system prompt."""
+    return _SYS_HDR + system_prompt.strip() + "\n"
+
+@lru_cache(maxsize=4)
+def _system_digest(system_prompt: str) -> bytes:
+    """Fixed-size digest of the system block, so cache keys don't rehash it per turn."""
+    return hashlib.blake2b(_system_block(system_prompt).encode(), digest_size=16).digest()
 
 def _estimate_tokens(text: str) -> int:
     """
@@ -42,65 +84,61 @@ def build_prompt(messages: List, system_prompt: str, new_user_prompt: str, max_c
     Returns:
         构建好的完整提示词
     """
+    # 1. 构建系统提示词和用户输入（必须保留）；用户输入在入口处只 strip 一次
+    new_user_prompt = new_user_prompt.strip()
+    system_part = _system_block(system_prompt)
+    user_part = _fmt_chat_raw("user", new_user_prompt)
+
+    # 新会话没有历史消息：直接拼出完整提示词，跳过 token 预算计算
+    if not messages:
+        return f"{system_part}{user_part}{_ASSIST_SUFFIX}"
+
     # 使用配置中的 context window 大小
     if max_context_tokens is None:
         max_context_tokens = settings.MODEL_N_CTX
     
-    # 1. 构建系统提示词和用户输入（必须保留）
-    system_part = fmt_chat("system", system_prompt)
-    user_part = fmt_chat("user", new_user_prompt.strip())
-    assistant_header = "<|start_header_id|>assistant<|end_header_id|>\n"
-    
     # 计算必须保留部分的 token 数
-    required_tokens = _estimate_tokens(system_part + user_part + assistant_header)
+    required_tokens = _estimate_tokens(system_part + user_part + _ASSIST_SUFFIX)
     
     # 2. 为历史消息预留空间（至少保留 512 tokens 给回复）
     available_tokens = max_context_tokens - required_tokens - 512
     
     # 3. 从历史消息中筛选，确保不超过可用空间
-    selected_messages = []
+    # 从最新的消息开始（倒序），因为要保留最近的对话；空消息跳过，每条只 strip 一次
+    chunks = [_fmt_chat_raw(m.role, c) for m in reversed(messages) if (c := (m.content or "").strip())]
+    selected = 0
     current_tokens = 0
     
-    # 从最新的消息开始（倒序），因为要保留最近的对话
-    for msg in reversed(messages):
-        role = msg.role
-        content = (msg.content or "").strip()
-        if not content:
-            continue
-        
-        msg_text = fmt_chat(role, content)
+    for msg_text in chunks:
         msg_tokens = _estimate_tokens(msg_text)
         
-        # 如果加上这条消息不超过限制，就添加
-        if current_tokens + msg_tokens <= available_tokens:
-            selected_messages.insert(0, msg)  # 插入到开头保持顺序
-            current_tokens += msg_tokens
-        else:
-            # 如果空间不足，停止添加
+        # 如果空间不足，停止添加
+        if current_tokens + msg_tokens > available_tokens:
             break
+        current_tokens += msg_tokens
+        selected += 1
     
-    # 4. 构建最终提示词
-    parts = []
-    parts.append(system_part)  # 系统提示词始终在最前面
-    
-    # 添加筛选后的历史消息
-    for msg in selected_messages:
-        role = msg.role
-        content = (msg.content or "").strip()
-        if content:
-            parts.append(fmt_chat(role, content))
-    
-    # 添加用户输入和助手标记
-    parts.append(user_part)
-    parts.append(assistant_header)
-    
-    return "".join(parts)
+    # 4. 构建最终提示词：系统提示词始终在最前面，然后是历史消息（恢复时间顺序）、用户输入和助手标记
+    # 在原列表上截断并反转，整段提示词由一次 join 拼出，不再单独生成 history 字符串
+    del chunks[selected:]
+    chunks.reverse()
+    return "".join((system_part, *chunks, user_part, _ASSIST_SUFFIX))
 
-def build_cache_key(user_id: str, session_id: str, prompt: str, prev_response: str | None = None) -> str:
-    cache_key = json.dumps({
-        "user_id": user_id,
-        "session_id": session_id,
-        "prompt": prompt.strip(),
-        "prev_response": prev_response.strip() if prev_response else None
-    }, sort_keys=True)
-    return cache_key
+def build_cache_key(user_id: str, prompt: str, history: Iterable = (), system_prompt: str = "") -> str:
+    """
+    Cache key for one conversation turn.
+
+    Keyed on the new user message, the `system_prompt` and a digest of the
+    `history` messages the prompt is built from, so editing prompt.txt misses.
+    Scoped to the user but not the session: asking the same thing after the
+    same history (e.g. the opening question of a new session, or a retried
+    turn) hits.
+    """
+    # user_id is a UUID and roles are fixed words, so \x1f delimits them;
+    # history text carries a length prefix, the prompt needs none as the last field
+    h = hashlib.blake2b(f"{user_id}\x1f".encode() + _system_digest(system_prompt), digest_size=16)
+    for m in history:
+        c = (m.content or "").strip().encode()
+        h.update(f"{m.role}\x1f".encode() + len(c).to_bytes(4, "little") + c)
+    h.update(b"\x1f" + prompt.strip().encode())
+    return h.hexdigest()
@@ -7,15 +7,27 @@ import { NextRequest, NextResponse } from 'next/server'
 
 const BACKEND_URL = process.env.BACKEND_API_URL || process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'
 
+/**
+ * Address of the browser that called this route. The backend rate-limits
+ * logins per client IP and only sees this server otherwise.
+ */
+function getClientIp(request: NextRequest): string | undefined {
+  const forwarded = request.headers.get('x-forwarded-for')
+  const last = forwarded?.split(',').pop()?.trim()
+  return request.ip || last || request.headers.get('x-real-ip') || undefined
+}
+
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json()
+    const clientIp = getClientIp(request)
 
     // Forward request to FastAPI backend
     const response = await fetch(`${BACKEND_URL}/auth/login`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...(clientIp ? { 'X-Forwarded-For': clientIp } : {}),
       },
       body: JSON.stringify(body),
     })